@@ -0,0 +1,20 @@
+from mitmproxy import ctx
+from mitmproxy.http import Response
+from urllib.parse import parse_qs, urlparse
+import profiler
+
+def handle_request(flow):
+    # Goes through the option so :set metro_profile always shows what's armed (configure() in main.py does the arming).
+    parsed = urlparse(flow.request.url)
+    if parsed.path.rstrip("/") == "/stop":
+        n = 0
+    else:
+        n = parse_qs(parsed.query).get("n", ["1"])[0]
+        n = min(int(n), profiler.max_samples) if n.isdecimal() else 1
+    if ctx.options.metro_profile == n:
+        profiler.arm(n) # Same value doesn't fire configure(), but the user still wants a fresh N.
+    else:
+        ctx.options.update(metro_profile=n)
+    body = f"profiling {profiler.remaining} handler call(s)\n"
+    flow.response = Response.make(200, body, {"Content-Type": "text/plain"})
+    return flow.response
\ No newline at end of file
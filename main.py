@@ -1,13 +1,27 @@
 import os
-from mitmproxy import http
-from handlers import finance, food, news, games, travel, weather
+from mitmproxy import http, ctx
+from handlers import finance, food, news, games, travel, weather, profiling
 import handlers
+import profiler
 # from handlers.app import mapcfg, weather, imagemap
 import re
 
+def load(loader):
+    loader.add_option("metro_profile", int, 0, "Profile the next N tile handler calls (0 = off).")
+    loader.add_option("metro_profile_dir", str, "profiles", "Where profiling output is written.")
+    profiler.on_done = lambda: ctx.options.update(metro_profile=0)
+
+def configure(updated):
+    if "metro_profile_dir" in updated:
+        profiler.out_dir = ctx.options.metro_profile_dir
+    if "metro_profile" in updated:
+        profiler.arm(ctx.options.metro_profile)
+
 def request(flow: http.HTTPFlow) -> None:
     url = flow.request.url.lower()
-    if "en-us.appex-rf.msn.com/cgtile/v1/en-us/news" in url:
+    if flow.request.pretty_host == profiler.PROFILE_HOST:
+        profiling.handle_request(flow)
+    elif "en-us.appex-rf.msn.com/cgtile/v1/en-us/news" in url:
         match = re.search(r"/(?:(\d+)|today)\.xml$", url.lower())
         if match:
             if 'today' in match.group(0).lower():
@@ -16,17 +30,17 @@ def request(flow: http.HTTPFlow) -> None:
                 tile_num = int(match.group(1))
                 
             if 1 <= tile_num <= 4:
-                flow.response = news.handle_request(flow, tile_num)
+                flow.response = profiler.run(news.handle_request, flow, tile_num)
     elif "cdf-anon.xboxlive.com/en-us/x8/feeds/1.1/tile-games" in url:
-        games.handle_request(flow)
+        profiler.run(games.handle_request, flow)
     elif "http://foodanddrink.services.appex.bing.com/api/feed/" in url:
-        food.handle_request(flow) 
+        profiler.run(food.handle_request, flow) 
     elif "http://finance.services.appex.bing.com/market.svc/apptilev2" in url:
-        finance.handle_request(flow)
+        profiler.run(finance.handle_request, flow)
     elif "http://travel.tile.appex.bing.com/api/livetile.xml" in url:
-        travel.handle_request(flow)
+        profiler.run(travel.handle_request, flow)
     elif "weather.tile.appex.bing.com" in url and "livetilev2" in url:
-        handlers.weather.handle_request(flow)
+        profiler.run(handlers.weather.handle_request, flow)
 
     # if "weatheroverviewbylatlong" in url and flow.request.method == "GET":
     #     flow.response = weather.handle_request(flow)
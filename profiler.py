@@ -0,0 +1,187 @@
+"""
+Runtime profiling for the tile handlers.
+
+Off by default. Arm it in one of two ways:
+  - mitmproxy option:  --set metro_profile=5   (or ":set metro_profile=5" in the console)
+  - reserved URL:      http://openmetro.profile/?n=5   (http://openmetro.profile/stop disarms)
+
+The next N handler calls each run under cProfile with a tracemalloc snapshot taken
+before and after. For every sampled call we drop three files into metro_profile_dir:
+  <stamp>-<handler>.prof       raw pstats dump (snakeviz, pstats, etc.)
+  <stamp>-<handler>.collapsed  collapsed stacks, feed it to flamegraph.pl or speedscope
+  <stamp>-<handler>.alloc.txt  top allocation sites made by the call and still held after it
+
+When it's off, run() is a single int check and a direct call. tracemalloc is only
+switched on for the sampled call itself, so it can't see module globals built at
+import time (e.g. the feedparser feed in logic/news.py). Start mitmproxy with
+PYTHONTRACEMALLOC=25 if you need those, the report then lists what's live too.
+"""
+
+import cProfile
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+
+PROFILE_HOST = "openmetro.profile"
+max_samples = 100 # Hard cap on N, so nobody can leave it writing files forever.
+top_allocs = 25 # How many allocation sites to write per sample.
+max_depth = 64 # Collapsed stacks deeper than this get cut off.
+max_stacks = 20000 # Stop collapsing after this many stacks, it runs on the event loop.
+min_share = 0.001 # Drop frames under 0.1% of the total time.
+
+remaining = 0
+out_dir = "profiles"
+on_done = None # Called once the last sample has been taken (main.py resets the option).
+
+# Our own bookkeeping shouldn't show up in the allocation report.
+_alloc_filters = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, pstats.__file__),
+    tracemalloc.Filter(False, __file__),
+    tracemalloc.Filter(False, "<frozen importlib.*>"),
+]
+
+
+def arm(n):
+    global remaining
+    remaining = min(max(int(n), 0), max_samples)
+
+
+def run(func, *args):
+    global remaining
+    if not remaining:
+        return func(*args)
+
+    remaining -= 1
+    try:
+        return _sample(func, args)
+    finally:
+        if not remaining and on_done:
+            try:
+                on_done()
+            except Exception:
+                logging.exception("Couldn't reset metro_profile")
+
+
+def _sample(func, args):
+    # Profiling must never break the tile, so anything that goes wrong on our side gets logged and dropped.
+    name = f"{func.__module__}.{func.__name__}"
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except Exception:
+        # e.g. "Another profiling tool is already active" on 3.12+
+        logging.exception(f"Couldn't start cProfile for {name}, running it unprofiled")
+        return func(*args)
+
+    # tracemalloc only runs for the call itself, unless someone started it before us (PYTHONTRACEMALLOC).
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(25) # Keep enough frames for the traceback to reach logic/*.
+    before = tracemalloc.take_snapshot()
+    try:
+        return func(*args)
+    finally:
+        profiler.disable()
+        try:
+            stats = pstats.Stats(profiler)
+            profiler.clear() # Free cProfile's own entries so they don't show up as "grown".
+            after = tracemalloc.take_snapshot()
+        except Exception:
+            logging.exception(f"Couldn't collect profile for {name}")
+            stats = None
+        if started:
+            tracemalloc.stop()
+        try:
+            if stats is not None:
+                _write_sample(name, stats, before, after, not started)
+        except Exception:
+            logging.exception(f"Couldn't write profile for {name}")
+
+
+def _write_sample(name, stats, before, after, already_tracing):
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{time.time_ns() % 1_000_000_000:09d}"
+    base = os.path.join(out_dir, f"{stamp}-{name}")
+
+    stats.dump_stats(base + ".prof")
+
+    with open(base + ".collapsed", "w") as f:
+        for stack, micros in collapse(stats.stats).items():
+            if micros > 0:
+                f.write(f"{stack} {micros}\n")
+
+    before = before.filter_traces(_alloc_filters)
+    after = after.filter_traces(_alloc_filters)
+    grown = [stat for stat in after.compare_to(before, "traceback") if stat.size_diff > 0]
+
+    with open(base + ".alloc.txt", "w") as f:
+        f.write(f"Top {top_allocs} allocation sites for {name} (still held after the call, innermost frame first)\n")
+        f.write("Only allocations made during the call are counted, module globals from import time aren't.\n")
+        f.write("Tiny single blocks on a def line are the profiler's own per-call frames, not the handler.\n\n")
+        _write_allocs(f, grown, True)
+
+        if already_tracing:
+            # tracemalloc was already on (PYTHONTRACEMALLOC), so we can also show what's been held since startup.
+            f.write(f"\nTop {top_allocs} live allocation sites after the call (traced since startup)\n\n")
+            _write_allocs(f, after.statistics("traceback"), False)
+
+
+def _write_allocs(f, allocs, diff):
+    for stat in allocs[:top_allocs]:
+        if diff:
+            f.write(f"+{stat.size_diff / 1024:.1f} KiB in {stat.count_diff:+d} blocks\n")
+        else:
+            f.write(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+        for line in stat.traceback.format(most_recent_first=True):
+            f.write(f"{line}\n")
+        f.write("\n")
+
+
+def _frame_name(func):
+    filename, line, funcname = func
+    if filename == "~":
+        return funcname # Built-ins, e.g. "<built-in method posix.stat>"
+    return f"{os.path.basename(filename)}:{funcname}:{line}"
+
+
+def collapse(raw):
+    """
+    Turn a pstats table into collapsed stacks ("a;b;c <microseconds>").
+
+    cProfile only records caller -> callee edges, not whole stacks, so we walk down
+    from the roots and split each function's callees by how much of its time came
+    through the edge we arrived on. It's an approximation, but it's good enough to
+    see which logic/* function is eating the time.
+    """
+    stacks = {}
+    children = {}
+    for callee, (_, _, _, _, callers) in raw.items():
+        for caller in callers:
+            children.setdefault(caller, []).append(callee)
+
+    roots = [func for func, (_, _, _, _, callers) in raw.items() if not callers]
+    cutoff = sum(raw[func][3] for func in roots) * min_share
+
+    def walk(func, path, share):
+        _, _, tottime, cumtime, _ = raw[func]
+        if cumtime * share < cutoff or len(path) >= max_depth or len(stacks) >= max_stacks:
+            return
+        path = path + [_frame_name(func)]
+        key = ";".join(path)
+        stacks[key] = stacks.get(key, 0) + int(tottime * share * 1_000_000)
+
+        for callee in children.get(func, []):
+            callee_cum = raw[callee][3]
+            if not callee_cum or _frame_name(callee) in path: # Skip recursion.
+                continue
+            edge_cum = raw[callee][4][func][3]
+            walk(callee, path, share * edge_cum / callee_cum)
+
+    for func in roots:
+        walk(func, [], 1.0)
+
+    return stacks
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("mitmproxy")
+
+import profiler
+from handlers import profiling
+
+
+class Options:
+    def __init__(self, metro_profile):
+        self.metro_profile = metro_profile
+        self.updates = []
+
+    def update(self, **kwargs):
+        self.updates.append(kwargs)
+        self.__dict__.update(kwargs)
+
+
+def request(monkeypatch, url, metro_profile=0):
+    options = Options(metro_profile)
+    monkeypatch.setattr(profiling, "ctx", SimpleNamespace(options=options))
+    flow = SimpleNamespace(request=SimpleNamespace(url=url), response=None)
+    profiling.handle_request(flow)
+    assert flow.response.status_code == 200
+    return options
+
+
+@pytest.fixture(autouse=True)
+def disarm():
+    yield
+    profiler.arm(0)
+
+
+@pytest.mark.parametrize("url, n", [
+    ("http://openmetro.profile/?n=5", 5),
+    ("http://openmetro.profile/", 1),
+    ("http://openmetro.profile/?n=abc", 1),
+    ("http://openmetro.profile/?n=%C2%B2", 1), # Superscript two, isdigit() but not int()-able.
+    ("http://openmetro.profile/?n=999999999", profiler.max_samples),
+])
+def test_arm_through_option(monkeypatch, url, n):
+    assert request(monkeypatch, url).updates == [{"metro_profile": n}]
+
+
+def test_stop(monkeypatch):
+    assert request(monkeypatch, "http://openmetro.profile/stop", 3).updates == [{"metro_profile": 0}]
+
+
+def test_same_value_rearms_directly(monkeypatch):
+    options = request(monkeypatch, "http://openmetro.profile/?n=5", 5)
+    assert options.updates == []
+    assert profiler.remaining == 5
@@ -0,0 +1,101 @@
+import cProfile
+import tracemalloc
+
+import profiler
+
+A = ("a.py", 1, "A")
+B = ("a.py", 2, "B")
+C = ("a.py", 3, "C")
+D = ("a.py", 4, "D")
+E = ("a.py", 5, "E")
+
+# pstats layout: func -> (cc, nc, tottime, cumtime, {caller: (cc, nc, tottime, cumtime)})
+# A calls B, C and E. B and C both call D. E calls itself.
+RAW = {
+    A: (1, 1, 1.0, 7.0, {}),
+    B: (1, 1, 2.0, 3.0, {A: (1, 1, 2.0, 3.0)}),
+    C: (1, 1, 1.0, 2.0, {A: (1, 1, 1.0, 2.0)}),
+    D: (2, 2, 2.0, 2.0, {B: (1, 1, 1.0, 1.0), C: (1, 1, 1.0, 1.0)}),
+    E: (1, 2, 1.0, 1.0, {A: (1, 1, 0.5, 1.0), E: (1, 1, 0.5, 0.5)}),
+}
+
+
+def test_collapse():
+    stacks = profiler.collapse(RAW)
+
+    assert stacks == {
+        "a.py:A:1": 1_000_000,
+        "a.py:A:1;a.py:B:2": 2_000_000,
+        "a.py:A:1;a.py:B:2;a.py:D:4": 1_000_000, # D's time is split between B and C.
+        "a.py:A:1;a.py:C:3": 1_000_000,
+        "a.py:A:1;a.py:C:3;a.py:D:4": 1_000_000,
+        "a.py:A:1;a.py:E:5": 1_000_000, # No E;E, recursion is folded in.
+    }
+    assert sum(stacks.values()) == sum(entry[2] for entry in RAW.values()) * 1_000_000
+
+
+def test_frame_name():
+    assert profiler._frame_name(("/x/logic/news.py", 8, "grab_articles")) == "news.py:grab_articles:8"
+    assert profiler._frame_name(("~", 0, "<built-in method posix.stat>")) == "<built-in method posix.stat>"
+
+
+def test_run_writes_sample(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, "out_dir", str(tmp_path))
+    done = []
+    monkeypatch.setattr(profiler, "on_done", lambda: done.append(True))
+
+    profiler.arm(1)
+    assert profiler.run(lambda: [bytes(1000) for _ in range(100)]) is not None
+
+    assert sorted(p.suffix for p in tmp_path.iterdir()) == [".collapsed", ".prof", ".txt"]
+    assert profiler.remaining == 0
+    assert not tracemalloc.is_tracing()
+    assert done == [True]
+
+
+def test_run_survives_write_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, "out_dir", str(tmp_path / "file" / "nope"))
+    (tmp_path / "file").write_text("")
+
+    profiler.arm(1)
+    assert profiler.run(lambda: "ok") == "ok"
+    assert profiler.remaining == 0
+    assert not tracemalloc.is_tracing()
+
+
+def test_run_survives_busy_profiler(monkeypatch):
+    class Busy(cProfile.Profile):
+        def enable(self, *args, **kwargs):
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(profiler.cProfile, "Profile", Busy)
+
+    profiler.arm(1)
+    assert profiler.run(lambda: "ok") == "ok"
+    assert profiler.remaining == 0
+    assert not tracemalloc.is_tracing()
+
+
+def test_run_reports_what_the_call_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, "out_dir", str(tmp_path))
+    kept = []
+
+    profiler.arm(1)
+    profiler.run(lambda: kept.append([str(i) * 10 for i in range(1000)]))
+
+    [alloc] = tmp_path.glob("*.alloc.txt")
+    report = alloc.read_text()
+    top = report.split("\n\n")[1]
+    assert float(top.split()[0]) > 10 # "+NN.N KiB ...", the list we kept comes first.
+    assert "test_profiler.py" in top
+    for own in ("tracemalloc.py", "cProfile.py", "pstats.py"):
+        assert own not in report
+
+
+def test_arm_is_capped():
+    profiler.arm(10**9)
+    assert profiler.remaining == profiler.max_samples
+    assert not tracemalloc.is_tracing() # Only runs during a sampled call.
+    profiler.arm(0)
+    assert profiler.remaining == 0
+    assert not tracemalloc.is_tracing()